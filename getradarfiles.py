@@ -1,10 +1,22 @@
 import os
 import json
-from collections import OrderedDict
+import logging
+import shutil
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import paramiko
 from stat import S_ISDIR
 paramiko.util.log_to_file("paramiko.log")
 
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 1 << 20
+MAX_SFTP_WORKERS = 4
+# Lista única das estacións de ondas: waves2db impórtaa desde aquí
+WAVES_STATIONS = ['SILL', 'PRIO', 'VILA']
+WAVES_SIGNATURE = 'wls'
+WAVES_REMOTE_ROOT_PATH = r'/Codar/SeaSonde/Data/Waves/Site_'
+
 
 def get_path_out(path_out):
     os.chdir(r'..')
@@ -13,10 +25,12 @@ def get_path_out(path_out):
     return path_out
 
 
+@functools.lru_cache(maxsize=None)
 def read_connection(input_file):
+    # Cada fío de descarga abre a súa conexión: lemos o JSON unha soa vez por execución
     try:
         with open(input_file, 'r') as f:
-            return json.load(f, object_pairs_hook=OrderedDict)
+            return json.load(f)
     except FileNotFoundError:
         print(f'File not found: {input_file} ')
         if input('Do you want to create one (y/n)?') == 'n':
@@ -24,21 +38,16 @@ def read_connection(input_file):
 
 
 def sftp_walk(sftp, remote_path):
-
-    path = remote_path
-    files = []
-    folders = []
-    for f in sftp.listdir_attr(remote_path):
-        if S_ISDIR(f.st_mode):
-            folders.append(f.filename)
-        else:
-            files.append(f.filename)
-    if files:
-        yield path, files
-    for folder in folders:
-        new_path = os.path.join(remote_path, folder)
-        for x in sftp_walk(new_path):
-            yield x
+    # Percorrido iterativo: un só listdir_attr por cartafol e os atributos devoltos xunto co nome
+    stack = [remote_path]
+    while stack:
+        path = stack.pop()
+        attrs = sftp.listdir_attr(path)
+        files = [(f.filename, f) for f in attrs if not S_ISDIR(f.st_mode)]
+        folders = [f.filename for f in attrs if S_ISDIR(f.st_mode)]
+        if files:
+            yield path, files
+        stack.extend(path + "/" + folder for folder in folders)
 
 
 def sftp_get_filenames_by_extension(sftp, remote_path, extension):
@@ -47,8 +56,9 @@ def sftp_get_filenames_by_extension(sftp, remote_path, extension):
     files = []
     for f in sftp.listdir_attr(remote_path):
         if not S_ISDIR(f.st_mode):
-            if f.filename[-3:] == extension:
-                files.append(f.filename)
+            if f.filename.endswith('.' + extension):
+                # Gardamos os atributos para comparar tamaño e data sen outro stat remoto
+                files.append((f.filename, f))
     if files:
         yield path, files
 
@@ -67,6 +77,24 @@ def get_stfp(connection_params_path):
     return sftp
 
 
+def download_file(sftp, remote_file, local_file, attr=None):
+    # Lectura anticipada e en pipeline: evita agardar a resposta de cada bloque antes de pedir o seguinte
+    with sftp.open(remote_file, 'rb') as rf:
+        rf.set_pipelined(True)
+        rf.prefetch()
+        with open(local_file, 'wb') as lf:
+            shutil.copyfileobj(rf, lf, length=COPY_BUFFER_SIZE)
+    # Copiamos a data remota para poder detectar na seguinte descarga se o ficheiro cambiou
+    if attr is not None:
+        os.utime(local_file, (attr.st_atime, attr.st_mtime))
+
+
+def is_downloaded(local_file, attr):
+    if not os.path.exists(local_file):
+        return False
+    return os.path.getsize(local_file) == attr.st_size and int(os.path.getmtime(local_file)) >= attr.st_mtime
+
+
 def download_files(local_dir, remote_path, sftp, signature, number_files):
     for path, files in sftp_get_filenames_by_extension(sftp, remote_path, signature):
         if number_files is None:
@@ -74,61 +102,107 @@ def download_files(local_dir, remote_path, sftp, signature, number_files):
         else:
             files = files[-1*number_files:]
 
-        for file in files:
-            print(f'Atopei o ficheiro {file} no cartafol {path}')
-            if file.split('.')[-1] == signature:
-                remote_file = path + "/" + file
-                if not os.path.exists(local_dir):
-                    os.makedirs(local_dir)
-                local_file = os.path.join(local_dir, file)
-                if os.path.exists(local_file) and number_files is  None:
-                    print(f'{file} xa está baixado')
-                    pass
-                else:
-                    print(f'Get from {remote_file} to {local_file}')
-                    sftp.get(remote_file, local_file)
-
-
-def get_radar_files(remote_root_path, root_dir, signature, stations, number_of_last_files=None):
-    root_dir = os.path.join(root_dir, 'radarhf_tmp', signature)
+        for file, attr in files:
+            logger.debug("Atopei o ficheiro %s no cartafol %s", file, path)
+            remote_file = path + "/" + file
+            if not os.path.exists(local_dir):
+                os.makedirs(local_dir)
+            local_file = os.path.join(local_dir, file)
+            if is_downloaded(local_file, attr):
+                logger.debug("%s xa está baixado", file)
+            else:
+                logger.debug("Get from %s to %s", remote_file, local_file)
+                download_file(sftp, remote_file, local_file, attr)
+
+
+def download_station(sftp, remote_root_path, root_dir, signature, station, number_of_last_files):
+    remote_path = remote_root_path + station
+    local_dir = os.path.join(root_dir, station)
+    download_files(local_dir, remote_path, sftp, signature, number_of_last_files)
+
+
+def download_station_own_sftp(remote_root_path, root_dir, signature, station, number_of_last_files):
+    # Cada fío abre o seu propio transporte: as conexións de paramiko non se comparten entre fíos
     sftp = get_stfp(r'pass/combine.json')
-    for station in stations:
-        remote_path = remote_root_path + station
-        local_dir = os.path.join(root_dir, station)
-        download_files(local_dir, remote_path, sftp, signature, number_of_last_files)
-    sftp.close()
+    try:
+        download_station(sftp, remote_root_path, root_dir, signature, station, number_of_last_files)
+    finally:
+        sftp.close()
 
 
-def get_radial_files(root_dir):
+def get_radar_files(remote_root_path, root_dir, signature, stations, number_of_last_files=None, sftp=None,
+                    on_station_done=None):
+    # on_station_done(station) chámase en canto remata a descarga de cada estación, para poder
+    # procesala mentres seguen as demais. Un erro nunha estación non detén as outras: rexístrase
+    # e o primeiro relánzase ao final
+    root_dir = os.path.join(root_dir, 'radarhf_tmp', signature)
+    errors = []
+
+    def station_finished(station, error=None):
+        if error is not None:
+            logger.error("Erro ao descargar a estación %s: %s", station, error)
+            errors.append(error)
+        elif on_station_done is not None:
+            on_station_done(station)
+
+    # Se se recibe unha conexión SFTP, reutilízase en serie e quen a abriu é quen a pecha
+    if sftp is not None:
+        for station in stations:
+            try:
+                download_station(sftp, remote_root_path, root_dir, signature, station, number_of_last_files)
+            except Exception as e:
+                station_finished(station, e)
+            else:
+                station_finished(station)
+    else:
+        # Sen conexión compartida, descárganse as estacións en paralelo, limitando as conexións simultáneas
+        max_workers = max(1, min(MAX_SFTP_WORKERS, len(stations)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(download_station_own_sftp, remote_root_path, root_dir, signature, station,
+                                       number_of_last_files): station
+                       for station in stations}
+            for future in as_completed(futures):
+                station_finished(futures[future], future.exception())
+
+    if errors:
+        raise errors[0]
+
+
+def get_radial_files(root_dir, sftp=None):
 
     signature = 'ruv'
     stations = ['LPRO', 'SILL', 'VILA', 'PRIO', 'FIST']
     remote_root_path = r'/Codar/SeaSonde/Data/RadialSites/Site_'
-    get_radar_files(remote_root_path, root_dir, signature, stations)
+    get_radar_files(remote_root_path, root_dir, signature, stations, sftp=sftp)
 
 
-def get_total_files(root_dir):
+def get_total_files(root_dir, sftp=None):
 
     signature = 'tuv'
     sites = ['GALI']
     remote_root_path =r'/Codar/SeaSonde/Data/Totals/Totals_'
-    get_radar_files(remote_root_path, root_dir, signature, sites)
+    get_radar_files(remote_root_path, root_dir, signature, sites, sftp=sftp)
 
 
-def get_waves_files(stations, root_dir, number_of_last_files=2):
-    signature = 'wls'
-    remote_root_path = r'/Codar/SeaSonde/Data/Waves/Site_'
-    get_radar_files(remote_root_path, root_dir, signature, stations, number_of_last_files)
+def get_waves_files(stations, root_dir, number_of_last_files=2, sftp=None, on_station_done=None):
+    get_radar_files(WAVES_REMOTE_ROOT_PATH, root_dir, WAVES_SIGNATURE, stations, number_of_last_files, sftp,
+                    on_station_done)
 
 
 def main():
     data_folder = r'../datos'
-    get_waves_files(data_folder)
-    get_radial_files(data_folder)
-    # get_total_files(data_folder)
+    # Unha única conexión SFTP para todas as estacións e tipos de ficheiro
+    sftp = get_stfp(r'pass/combine.json')
+    try:
+        get_waves_files(WAVES_STATIONS, data_folder, sftp=sftp)
+        get_radial_files(data_folder, sftp=sftp)
+        # get_total_files(data_folder, sftp=sftp)
+    finally:
+        sftp.close()
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     main()
 
 
@@ -1,10 +1,15 @@
 import io
-from datetime import datetime
+import functools
+import logging
+from itertools import repeat
 import json
-from collections import OrderedDict
 import psycopg2
+from psycopg2.extras import execute_values
 import pandas as pd
 
+# Los mensajes por fichero van a nivel DEBUG; avisos y errores a WARNING/ERROR
+logger = logging.getLogger(__name__)
+
 
 class Wave:
     """
@@ -18,10 +23,15 @@ class Wave:
         'FLAG': int, 'TYRS': int, 'TMON': int, 'TDAY': int, 'THRS': int,
         'TMIN': int, 'TSEC': int, 'PMWH': float, 'LOND': float, 'LATD': float
     }
+    # Los enteros se guardan como 'Int64' (admite nulos) para que una celda inválida no impida la conversión
+    _NULLABLE_TYPES = {int: 'Int64', float: 'float64'}
+    # Columnas imprescindibles para construir una fila de waves.values
+    _ROW_COLUMNS = ['MWHT', 'MWPD', 'WAVB', 'TYRS', 'TMON', 'TDAY', 'THRS', 'TMIN', 'TSEC']
 
-    def __init__(self, file_wls: str):
+    def __init__(self, file_wls):
         """
-        Constructor de la clase.
+        Constructor de la clase. Acepta la ruta del fichero o un objeto fichero binario ya abierto
+        (por ejemplo, un fichero remoto abierto por SFTP).
         """
         self.metadata = {}
         self.data_tables = {}  # Usamos un diccionario: {range_cell_number: DataFrame}
@@ -29,99 +39,113 @@ class Wave:
 
         self._process_wls_file(file_wls)
 
-    def _process_wls_file(self, file_wls: str):
+    def _process_wls_file(self, file_wls):
         """
         Método principal que coordina la lectura y procesamiento del fichero.
         """
-        try:
-            with open(file_wls, 'rb') as f:
-                content_raw = [line.decode('utf-8', errors='ignore').strip() for line in f.readlines()]
-        except FileNotFoundError:
-            print(f"ERROR: Fichero no encontrado en la ruta: {file_wls}")
-            return  # Termina la inicialización si el fichero no existe
-
-        self._parse_metadata(content_raw)
-        self._parse_tables(content_raw)
-        self._convert_data_types()
-
-    def _parse_metadata(self, content_raw: list):
+        if hasattr(file_wls, 'read'):
+            # Objeto fichero: lo leemos de una vez para no pedir cada línea por separado
+            lines = file_wls.read().decode('utf-8', errors='ignore').splitlines()
+            global_header, table_blocks = self._parse_lines(lines)
+        else:
+            try:
+                # Recorremos el fichero línea a línea sin cargarlo entero en memoria
+                with open(file_wls, 'r', encoding='utf-8', errors='ignore') as f:
+                    global_header, table_blocks = self._parse_lines(f)
+            except FileNotFoundError:
+                logger.error("ERROR: Fichero no encontrado en la ruta: %s", file_wls)
+                return  # Termina la inicialización si el fichero no existe
+
+        self._parse_tables(global_header, table_blocks)
+
+    def _parse_lines(self, lines) -> tuple[list, list]:
         """
-        Extrae los metadatos de la cabecera del fichero.
+        Recorre el fichero en una única pasada: rellena los metadatos de la cabecera y devuelve
+        la cabecera global de columnas junto con los bloques de datos (%TableStart ... %TableEnd)
+        como tuplas (range_cell, data_lines).
         """
-        metadata_lines = []
-        for line in content_raw:
-            if line.startswith('%Table'):
-                break
-            if line.startswith('%') and not line.startswith('%%'):
-                metadata_lines.append(line.strip('%'))
-
-        for line in metadata_lines:
-            if ':' in line:
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    key = parts[0].strip()
-                    value = parts[1].strip()
-                    if key:
-                        self.metadata[key] = value
-
-    def _parse_tables(self, content_raw: list):
-        """
-        Encuentra y procesa cada bloque de tabla en el fichero.
-        Esta versión definitiva lee primero la cabecera global del fichero y luego
-        procesa los bloques de datos, haciéndola compatible con ambos formatos.
-        """
-        # --- PASO 1: Encontrar la cabecera de columnas global para todo el fichero ---
         global_header = []
-        for line in content_raw:
-            if '%TableColumnTypes:' in line:
+        table_blocks = []
+        in_header = True  # Los metadatos están antes de la primera línea '%Table'
+        in_block = False
+        range_cell = -1
+        data_lines = []
+
+        for line in lines:
+            line = line.strip()
+
+            if not global_header and '%TableColumnTypes:' in line:
                 global_header = line.split(':', 1)[1].split()
-                break  # Dejamos de buscar una vez encontrada
 
-        if not global_header:
-            print(f"AVISO: No se encontró la línea '%TableColumnTypes:' en el fichero. No se puede procesar.")
-            return
+            if in_header:
+                if line.startswith('%Table'):
+                    in_header = False
+                elif line.startswith('%') and not line.startswith('%%'):
+                    self._add_metadata(line.strip('%'))
 
-        # --- PASO 2: Encontrar todos los bloques de datos (%TableStart ... %TableEnd) ---
-        table_blocks = []
-        current_block = []
-        in_block = False
-        for line in content_raw:
             if line.startswith('%TableStart'):
                 in_block = True
                 # Reiniciamos el bloque actual justo después de encontrar la marca de inicio
-                current_block = []
-                continue # No incluimos la línea %TableStart en el bloque
-            if line.startswith('%TableEnd'):
+                range_cell = -1
+                data_lines = []
+            elif line.startswith('%TableEnd'):
                 in_block = False
-                table_blocks.append(current_block)
-            if in_block:
-                current_block.append(line)
-
-        if not table_blocks:
-            print("AVISO: No se encontraron bloques de datos (%TableStart/%TableEnd) en el fichero.")
-            return
-
-        # --- PASO 3: Iterar sobre cada bloque de datos encontrado ---
-        for block in table_blocks:
-            range_cell = -1
-            data_str = ""
-
-            # Dentro del bloque, buscamos el RangeCell (para Formato A) y las líneas de datos
-            for line in block:
-                if 'RangeCell:' in line and line.strip().startswith('%'):
+                table_blocks.append((range_cell, data_lines))
+            elif in_block:
+                # Dentro del bloque, buscamos el RangeCell (para Formato A) y las líneas de datos
+                if 'RangeCell:' in line and line.startswith('%'):
                     try:
                         range_cell = int(line.split(':')[1].strip())
                     except (ValueError, IndexError):
-                        print(f"AVISO: No se pudo leer el número de RangeCell en la línea: {line}")
+                        logger.warning("AVISO: No se pudo leer el número de RangeCell en la línea: %s", line)
                         range_cell = -1
                 elif not line.startswith('%'):
-                    data_str += line + '\n'
+                    data_lines.append(line)
+
+        return global_header, table_blocks
 
-            if not data_str:
+    def _add_metadata(self, line: str):
+        """
+        Guarda una línea 'clave: valor' de la cabecera en los metadatos.
+        """
+        if ':' in line:
+            parts = line.split(':', 1)
+            if len(parts) == 2:
+                key = parts[0].strip()
+                value = parts[1].strip()
+                if key:
+                    self.metadata[key] = value
+
+    def _parse_tables(self, global_header: list, table_blocks: list):
+        """
+        Convierte cada bloque de datos en un DataFrame usando la cabecera global del fichero,
+        haciéndolo compatible con ambos formatos.
+        """
+        if not global_header:
+            logger.warning("AVISO: No se encontró la línea '%TableColumnTypes:' en el fichero. No se puede procesar.")
+            return
+
+        if not table_blocks:
+            logger.warning("AVISO: No se encontraron bloques de datos (%TableStart/%TableEnd) en el fichero.")
+            return
+
+        # Columnas conocidas y su tipo, calculados una vez por fichero
+        dtype_map = {col: self._NULLABLE_TYPES[self._DATA_TYPES[col]]
+                     for col in global_header if col in self._DATA_TYPES}
+
+        for range_cell, data_lines in table_blocks:
+            if not data_lines:
                 continue
 
-            # Usamos la cabecera global que encontramos en el PASO 1
-            df_block = pd.read_csv(io.StringIO(data_str), sep=r'\s+', header=None, names=global_header, na_values='999.00')
+            # Unimos las líneas una sola vez en lugar de concatenar cadenas dentro del bucle
+            data_str = '\n'.join(data_lines)
+            # sep=r'\s+' lo resuelve pandas con el tokenizador de espacios en C; fijamos engine='c'
+            # para que falle en lugar de pasar en silencio al parser de Python, mucho más lento
+            try:
+                df_block = self._read_block(data_str, global_header, dtype_map)
+            except pd.errors.ParserError as e:
+                logger.warning("AVISO: El bloque de tabla se omitirá por tener un formato incorrecto. Error: %s", e)
+                continue
 
             # --- Lógica de decisión para asignar los datos ---
             if range_cell != -1: # Formato A: El RangeCell se especificó dentro del bloque
@@ -134,42 +158,62 @@ class Wave:
                 for rc_num, group_df in df_block.groupby('RCLL'):
                     self.data_tables[rc_num] = group_df.copy()
             else:
-                print("AVISO: El bloque de tabla se omitirá (no contiene '% RangeCell:' ni columna 'RCLL').")
+                logger.warning("AVISO: El bloque de tabla se omitirá (no contiene '% RangeCell:' ni columna 'RCLL').")
 
         if self.data_tables:
             first_key = next(iter(self.data_tables))
             self.headers = list(self.data_tables[first_key].columns)
 
-    def _convert_data_types(self):
+    @classmethod
+    def _read_block(cls, data_str: str, global_header: list, dtype_map: dict) -> pd.DataFrame:
         """
-        Aplica los tipos de datos correctos a todas las columnas conocidas en las tablas.
+        Lee un bloque de tabla tipando las columnas directamente en read_csv. Solo si alguna celda
+        no es numérica se vuelve a leer sin tipos y se convierte columna a columna.
         """
-        for rc_num, table in self.data_tables.items():
-            types_to_apply = {col: self._DATA_TYPES[col] for col in table.columns if col in self._DATA_TYPES}
-            for col, dtype in types_to_apply.items():
-                self.data_tables[rc_num][col] = pd.to_numeric(table[col], errors='coerce').astype(dtype,
-                                                                                                  errors='ignore')
+        try:
+            return pd.read_csv(io.StringIO(data_str), sep=r'\s+', header=None, names=global_header,
+                               dtype=dtype_map, na_values=['999.00'], engine='c')
+        except pd.errors.ParserError:
+            raise
+        except (TypeError, ValueError):
+            # Celdas no numéricas o decimales en una columna entera
+            df_block = pd.read_csv(io.StringIO(data_str), sep=r'\s+', header=None, names=global_header,
+                                   na_values=['999.00'], engine='c')
+            cls._convert_data_types(df_block, dtype_map)
+            return df_block
 
     @staticmethod
-    def get_time(row: pd.Series) -> datetime:
+    def _convert_data_types(df_block: pd.DataFrame, dtype_map: dict):
         """
-        Extrae y convierte la fecha y hora de una fila de datos.
+        Convierte las columnas conocidas del bloque a su tipo; una celda no numérica queda como nulo
+        sin descartar el resto del bloque.
         """
-        return datetime(
-            int(row['TYRS']), int(row['TMON']), int(row['TDAY']),
-            int(row['THRS']), int(row['TMIN']), int(row['TSEC'])
-        )
-
-    @staticmethod
-    def get_wave_values(row: pd.Series) -> tuple[float, float, float]:
+        for col, dtype in dtype_map.items():
+            values = pd.to_numeric(df_block[col], errors='coerce')
+            try:
+                df_block[col] = values.astype(dtype)
+            except (TypeError, ValueError):
+                # Valores no enteros en una columna entera: se mantienen como float
+                df_block[col] = values
+
+    def get_rows(self, id_site: int) -> list:
         """
-        Extrae los valores principales de oleaje de una fila de datos.
+        Devuelve las filas válidas de todas las tablas como tuplas listas para insertar en waves.values.
         """
-        return (
-            float(row['MWHT']),
-            float(row['MWPD']),
-            float(row['WAVB'])
-        )
+        rows = []
+        for rcell_number, tabla in self.data_tables.items():
+            # Si hay valores NaN (por datos inválidos o filas incompletas), descartamos esas filas
+            df = tabla.dropna(subset=self._ROW_COLUMNS)
+            # Fechas con los segundos a cero; se pasan tal cual a psycopg2, sin formatearlas como texto
+            dates = pd.to_datetime(dict(year=df['TYRS'], month=df['TMON'], day=df['TDAY'],
+                                        hour=df['THRS'], minute=df['TMIN'], second=0), errors='coerce')
+            valid = dates.notna()
+            df, dates = df[valid], dates[valid]
+
+            rows.extend(zip(repeat(id_site), repeat(int(rcell_number)),
+                            dates.tolist(),
+                            df['MWHT'].tolist(), df['MWPD'].tolist(), df['WAVB'].tolist()))
+        return rows
 
 
 # --- FUNCIONES DE UTILIDAD ---
@@ -181,12 +225,14 @@ def convert_into_dictionary(list_of_tuples: list) -> dict:
     return {key: value for key, value in list_of_tuples}
 
 
+@functools.lru_cache(maxsize=None)
 def read_connection(input_file):
+    # Se guarda en caché por ruta: el mismo JSON se lee una sola vez por ejecución
     try:
         with open(input_file, 'r') as f:
-            return json.load(f, object_pairs_hook=OrderedDict)
+            return json.load(f)
     except FileNotFoundError:
-        print(f'File not found: {input_file} ')
+        logger.error('File not found: %s', input_file)
         # Evitar 'input' en scripts automáticos; mejor terminar con un error.
         return None
 
@@ -206,79 +252,240 @@ def get_db_connection(db_json):
     try:
         return psycopg2.connect(connection_string)
     except psycopg2.OperationalError as e:
-        print(f"PRECAUCIÓN: ERROR AL CONECTAR CON {database_data['host']}\n{e}")
+        logger.error("PRECAUCIÓN: ERROR AL CONECTAR CON %s\n%s", database_data['host'], e)
         return None
 
 
 # --- FUNCIÓN PRINCIPAL DE PROCESAMIENTO ---
 
-def wave2db(site_name, path, file_in):
-    db_json_file = r'./pass/svr_database.json'
+DB_JSON_FILE = r'./pass/svr_database.json'
+
+# Requiere la restricción única definida en sql/waves_values_uq.sql
+SQL_INSERT_VALUES = '''INSERT INTO waves.values(fk_site, fk_range, datetime, height, period, direction)
+                       VALUES %s ON CONFLICT ON CONSTRAINT waves_values_uq DO NOTHING'''
+
+# Filas por sentencia en execute_values
+INSERT_PAGE_SIZE = 10000
+
+# A partir de este número de filas (cargas históricas) se usa COPY a través de una tabla temporal
+COPY_MIN_ROWS = 5000
+
+# Solo las seis columnas que se copian: sin restricciones NOT NULL ni valores por defecto (secuencias) de waves.values
+SQL_CREATE_STAGE = '''CREATE TEMP TABLE IF NOT EXISTS waves_values_stage AS
+                      SELECT fk_site, fk_range, datetime, height, period, direction
+                      FROM waves.values WITH NO DATA'''
+
+SQL_COPY_STAGE = '''COPY waves_values_stage(fk_site, fk_range, datetime, height, period, direction) FROM STDIN'''
+
+SQL_INSERT_FROM_STAGE = '''INSERT INTO waves.values(fk_site, fk_range, datetime, height, period, direction)
+                           SELECT DISTINCT ON (datetime, fk_site, fk_range)
+                                  fk_site, fk_range, datetime, height, period, direction
+                           FROM waves_values_stage
+                           ON CONFLICT ON CONSTRAINT waves_values_uq DO NOTHING;
+                           TRUNCATE waves_values_stage'''
+
+
+SQL_SELECT_EXISTING = '''SELECT fk_site, fk_range, datetime FROM waves.values
+                         WHERE fk_site = ANY(%s) AND fk_range = ANY(%s) AND datetime BETWEEN %s AND %s'''
+
+
+def filter_existing(cursor, rows: list) -> list:
+    """
+    Descarta las filas que ya están en la base de datos con una única consulta por rango de fechas.
+    """
+    if not rows:
+        return rows
+
+    sites = list({row[0] for row in rows})
+    rcells = list({row[1] for row in rows})
+    dates = [row[2] for row in rows]
+    cursor.execute(SQL_SELECT_EXISTING, (sites, rcells, min(dates), max(dates)))
+    existing = set(cursor.fetchall())
+
+    return [row for row in rows if row[:3] not in existing]
+
+
+def copy_rows(cursor, rows: list):
+    """
+    Vuelca las filas a una tabla temporal con COPY y las pasa a waves.values en una sola sentencia.
+    """
+    buffer = io.StringIO()
+    for id_site, rcell_number, date, height, period, direction in rows:
+        buffer.write(f"{id_site}\t{rcell_number}\t{date}\t{height}\t{period}\t{direction}\n")
+    buffer.seek(0)
+
+    # La tabla temporal vive lo que dure la sesión y no escribe en el WAL
+    cursor.execute(SQL_CREATE_STAGE)
+    cursor.copy_expert(SQL_COPY_STAGE, buffer)
+    cursor.execute(SQL_INSERT_FROM_STAGE)
+
+
+def insert_rows(cursor, rows: list):
+    """
+    Inserta las filas en waves.values eligiendo COPY o execute_values según el volumen.
+    """
+    if len(rows) >= COPY_MIN_ROWS:
+        copy_rows(cursor, rows)
+    else:
+        execute_values(cursor, SQL_INSERT_VALUES, rows, page_size=INSERT_PAGE_SIZE)
+
+
+def get_id_sites(connection) -> dict:
+    """
+    Devuelve el diccionario {código de sitio: pk} de la tabla waves.sites.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''SELECT code, pk FROM waves.sites ORDER BY pk ASC''')
+        return convert_into_dictionary(cursor.fetchall())
+
+
+def wave_rows(id_sites, site_name, path, file_in) -> list:
+    """
+    Lee un fichero .wls y devuelve sus filas candidatas para waves.values, sin tocar la base de datos.
+    Devuelve None si el fichero no se pudo procesar.
+    """
     full_path_file = f"{path}/{file_in}"
 
-    print(f"Procesando fichero: {full_path_file}")
-    wave = Wave(full_path_file)
+    logger.debug("Procesando fichero: %s", full_path_file)
 
-    connection = get_db_connection(db_json_file)
-    if not connection:
-        print(f"No se pudo obtener la conexión a la base de datos para el fichero {file_in}. Abortando.")
-        return
+    return _source_rows(id_sites, site_name, full_path_file, file_in)
+
+
+def _source_rows(id_sites, site_name, source, file_in) -> list:
+    id_site = id_sites.get(site_name)
+    if id_site is None:
+        logger.error("ERROR: El sitio '%s' no se encontró en la base de datos.", site_name)
+        return None
 
+    wave = Wave(source)
+    # Wave avisa de sus propios fallos (fichero inexistente, sin cabecera o sin bloques válidos)
+    # y deja las tablas vacías: eso no cuenta como fichero procesado
+    if not wave.data_tables:
+        logger.warning("AVISO: El fichero %s no contiene tablas de datos válidas.", file_in)
+        return None
+
+    # Reunimos todas las filas candidatas de todas las tablas para insertarlas de una vez
     try:
-        with connection, connection.cursor() as cursor:
-            sql = '''SELECT code, pk FROM waves.sites ORDER BY pk ASC'''
-            cursor.execute(sql)
-            id_sites = convert_into_dictionary(cursor.fetchall())
-            id_site = id_sites.get(site_name)
+        return wave.get_rows(id_site)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning("AVISO: No se pudieron extraer las filas del fichero %s. Error: %s", file_in, e)
+        return None
 
-            if id_site is None:
-                print(f"ERROR: El sitio '{site_name}' no se encontró en la base de datos.")
-                return
 
-            # Iteramos directamente sobre el diccionario .data_tables
-            for rcell_number, tabla in wave.data_tables.items():
+def drop_seen(rows: list, seen: set) -> list:
+    """
+    Devuelve las filas cuya clave (fk_site, fk_range, datetime) no está en 'seen' y las añade a él.
+    """
+    unique_rows = []
+    for row in rows:
+        key = row[:3]
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append(row)
+    return unique_rows
 
-                # Usamos .iterrows() para una iteración más eficiente y limpia
-                for index, row in tabla.iterrows():
-                    try:
-                        current_date = Wave.get_time(row)
-                        height, period, direction = Wave.get_wave_values(row)
 
-                        # Si hay valores NaN (por datos inválidos o filas incompletas), saltamos esa fila
-                        if pd.isna(height) or pd.isna(current_date) or pd.isna(period) or pd.isna(direction):
-                            continue
+def rows2db(connection, file_rows: list) -> bool:
+    """
+    Inserta un lote formado por las filas de uno o varios ficheros (una lista de filas por fichero)
+    usando una conexión ya abierta. La confirmación de la transacción corresponde a quien llama.
+    Devuelve True si el lote se insertó.
+    """
+    try:
+        with connection.cursor() as cursor:
+            # Un fallo en este lote no debe invalidar lo ya insertado en la transacción compartida
+            cursor.execute('SAVEPOINT wave2db')
+            try:
+                # Una consulta por fichero para conocer lo ya cargado, limitada a la ventana de fechas
+                # de ese fichero, y un único INSERT por lotes con el resto;
+                # la restricción única sigue protegiendo frente a duplicados
+                rows = []
+                for batch in file_rows:
+                    rows.extend(filter_existing(cursor, batch))
+                insert_rows(cursor, rows)
+            except Exception:
+                cursor.execute('ROLLBACK TO SAVEPOINT wave2db')
+                raise
+            cursor.execute('RELEASE SAVEPOINT wave2db')
 
-                       # print(f'Range = {rcell_number}: date: {current_date} ---> ({height}, {period}, {direction})')
+    except (Exception, psycopg2.Error) as error:
+        logger.error("Error durante la operación con la base de datos: %s", error)
+        return False
 
-                        date_sql = current_date.strftime('%Y-%m-%d %H:%M:00.00')
+    return True
 
-                        sql_select = '''SELECT 1 FROM waves.values WHERE datetime = %s AND fk_site = %s AND fk_range = %s'''
-                        params_select = (date_sql, id_site, rcell_number)
-                        cursor.execute(sql_select, params_select)
-                        existe = bool(cursor.fetchone())
 
-                        if not existe:
-                            sql_insert = '''INSERT INTO waves.values(fk_site, fk_range, datetime, height, period, direction) 
-                                            VALUES(%s, %s, %s, %s, %s, %s)'''
-                            params_insert = (id_site, rcell_number, date_sql, height, period, direction)
-                            cursor.execute(sql_insert, params_insert)
+def wave2db(connection, id_sites, site_name, path, file_in) -> bool:
+    """
+    Procesa un fichero .wls e inserta sus valores usando una conexión ya abierta.
+    La confirmación de la transacción corresponde a quien llama. Devuelve True si sus datos se guardaron.
+    """
+    rows = wave_rows(id_sites, site_name, path, file_in)
+    if rows is None:
+        return False
+    return rows2db(connection, [rows])
 
-                    except (ValueError, TypeError, KeyError) as e:
-                        print(
-                            f"AVISO: Se saltó una fila por datos incorrectos o faltantes en la tabla {rcell_number}. Error: {e}")
-                        continue
 
-    except (Exception, psycopg2.Error) as error:
-        print(f"Error durante la operación con la base de datos: {error}")
+def stream2db(connection, id_sites, sftp, site_name, remote_file) -> bool:
+    """
+    Procesa un fichero .wls leyéndolo directamente del servidor SFTP, sin guardarlo antes en disco.
+    La confirmación de la transacción corresponde a quien llama. Devuelve True si sus datos se guardaron.
+    """
+    logger.debug("Procesando fichero remoto: %s", remote_file)
+
+    try:
+        with sftp.open(remote_file, 'rb') as rf:
+            rf.prefetch()
+            rows = _source_rows(id_sites, site_name, rf, remote_file)
+    except OSError as e:
+        logger.error("ERROR: No se pudo leer el fichero remoto %s: %s", remote_file, e)
+        return False
+
+    if rows is None:
+        return False
+    return rows2db(connection, [rows])
+
 
+def waves2db_batch(station, path, filenames):
+    """
+    Procesa varios ficheros .wls de una estación con una única conexión, un único lote de filas
+    y una única confirmación al final. Devuelve los nombres de los ficheros cuyos datos quedaron guardados.
+    """
+    connection = get_db_connection(DB_JSON_FILE)
+    if not connection:
+        logger.error("No se pudo obtener la conexión a la base de datos. No se procesa la estación %s.", station)
+        return []
+
+    processed = []
+    try:
+        with connection:
+            id_sites = get_id_sites(connection)
+
+            file_rows = []
+            seen = set()
+            for filename in filenames:
+                rows = wave_rows(id_sites, station, path, filename)
+                if rows is None:
+                    continue
+                file_rows.append(drop_seen(rows, seen))
+                processed.append(filename)
+
+            if not rows2db(connection, file_rows):
+                return []
+    except psycopg2.Error as error:
+        logger.error("Error al guardar los datos de la estación %s: %s", station, error)
+        return []
     finally:
-        if connection:
-            connection.close()
+        connection.close()
+
+    return processed
 
 
 # --- BLOQUE DE EJECUCIÓN PRINCIPAL ---
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # Aquí puedes definir los ficheros que quieres procesar
     files_to_process = {
         'PRIO': ['WVLM_PRIO_2022_02_01_0000.wls', 'WVLM_PRIO_2025_07_01_0000.wls'],
@@ -287,7 +494,27 @@ if __name__ == '__main__':
 
     base_path = r'../../datos/radarhf_tmp/wls'  # Ajusta esta ruta base
 
-    for station, filenames in files_to_process.items():
-        for filename in filenames:
-            station_path = f"{base_path}/{station}"
-            wave2db(station, station_path, filename)
\ No newline at end of file
+    # Una única conexión y una única transacción para todos los ficheros
+    connection = get_db_connection(DB_JSON_FILE)
+    if not connection:
+        logger.error("No se pudo obtener la conexión a la base de datos. Abortando.")
+        quit()
+
+    try:
+        with connection:
+            id_sites = get_id_sites(connection)
+
+            # Acumulamos las filas de todos los ficheros y las insertamos en un único lote.
+            # Los ficheros consecutivos se solapan en el tiempo: descartamos aquí las claves repetidas
+            file_rows = []
+            seen = set()
+            for station, filenames in files_to_process.items():
+                for filename in filenames:
+                    station_path = f"{base_path}/{station}"
+                    rows = wave_rows(id_sites, station, station_path, filename)
+                    if rows:
+                        file_rows.append(drop_seen(rows, seen))
+
+            rows2db(connection, file_rows)
+    finally:
+        connection.close()
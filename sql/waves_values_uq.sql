@@ -0,0 +1,14 @@
+-- Restricción única sobre (datetime, fk_site, fk_range) en waves.values.
+-- wave2db inserta con ON CONFLICT ON CONSTRAINT waves_values_uq DO NOTHING,
+-- por lo que debe existir antes de cargar ficheros.
+
+-- Elimina posibles duplicados previos, conservando una fila por clave
+DELETE FROM waves.values a
+      USING waves.values b
+      WHERE a.ctid > b.ctid
+        AND a.datetime = b.datetime
+        AND a.fk_site = b.fk_site
+        AND a.fk_range = b.fk_range;
+
+ALTER TABLE waves.values
+    ADD CONSTRAINT waves_values_uq UNIQUE (datetime, fk_site, fk_range);
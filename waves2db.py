@@ -1,87 +1,339 @@
 import os
+import logging
+import functools
+import queue
+import shutil
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import getradarfiles
 import radarhf_waves  # El fichero que contiene la clase Wave y las funciones de BBDD
 
 # --- CONSTANTE GLOBAL CON LAS ESTACIONES ---
-# Si necesitas añadir más estaciones en el futuro, solo tienes que cambiar esta línea.
-STATIONS = ['SILL', 'PRIO', 'VILA']
+# La lista se define solo en getradarfiles.WAVES_STATIONS; para añadir estaciones basta con cambiarla allí.
+STATIONS = getradarfiles.WAVES_STATIONS
 
+WLS_SUFFIX = '.wls'
 
+# Los mensajes por fichero van a nivel DEBUG; a nivel INFO solo se emite un resumen por estación
+logger = logging.getLogger(__name__)
+
+# Hilo para borrar en segundo plano los directorios ya procesados; se crea la primera vez que hace falta
+_cleanup_executor = None
+_cleanup_lock = threading.Lock()
+
+
+def get_station_paths(data_folder) -> dict:
+    """
+    Devuelve el diccionario {estación: directorio local de sus ficheros .wls}.
+    Se calcula una vez y se pasa a las funciones que recorren las estaciones.
+    """
+    return {station: os.path.join(data_folder, 'radarhf_tmp', 'wls', station) for station in STATIONS}
+
+
+@functools.lru_cache(maxsize=None)
 def create_station_directories(data_folder):
     """
     Asegura que los directorios locales para cada estación existan.
-    Si un directorio no existe, lo crea.
+    Si un directorio no existe, lo crea. Solo actúa la primera vez para cada data_folder;
+    si hiciera falta repetirlo, se puede vaciar la caché con create_station_directories.cache_clear().
     """
-    print("--- Verificando y creando directorios de estaciones ---")
-    for station in STATIONS:
-        path = os.path.join(data_folder, 'radarhf_tmp', 'wls', station)
-        # os.makedirs crea la ruta completa y con exist_ok=True no falla si ya existe
-        os.makedirs(path, exist_ok=True)
-        print(f"Directorio asegurado: {path}")
+    logger.info("--- Verificando y creando directorios de estaciones ---")
+    for path in get_station_paths(data_folder).values():
+        # En el caso habitual el directorio ya existe y basta con un stat, sin intentar el mkdir
+        if not os.path.isdir(path):
+            # os.makedirs crea la ruta completa y con exist_ok=True no falla si ya existe
+            os.makedirs(path, exist_ok=True)
+        logger.debug("Directorio asegurado: %s", path)
 
 
-def waves2db(data_folder):
+def waves2db(station_paths):
     """
     Busca y procesa todos los ficheros .wls para las estaciones definidas.
+    Cada estación se procesa en su propio hilo, con su propia conexión y transacción.
+    Devuelve un diccionario {estación: [ficheros procesados con éxito]}.
     """
-    for station in STATIONS:
-        path = os.path.join(data_folder, 'radarhf_tmp', 'wls', station)
+    return _run_per_station(_process_station, station_paths)
 
-        if not os.path.isdir(path):
-            print(f"Directorio no encontrado, se omite el procesamiento para: {path}")
-            continue
 
-        print(f"\n--- Buscando ficheros para procesar en: {path} ---")
+def _run_per_station(function, *args):
+    # Las estaciones son independientes y el trabajo es de E/S (disco y base de datos)
+    with ThreadPoolExecutor(max_workers=len(STATIONS)) as executor:
+        futures = {station: executor.submit(function, station, *args) for station in STATIONS}
+        # .result() propaga las excepciones que se produzcan dentro de los hilos
+        return {station: future.result() for station, future in futures.items()}
+
+
+def _process_station(station, station_paths):
+    path = station_paths[station]
+
+    logger.info("--- Buscando ficheros para procesar en: %s ---", path)
+
+    # os.scandir devuelve las entradas con su nombre y tipo sin llamadas adicionales al sistema.
+    # No comprobamos antes con isdir: el propio scandir falla si el directorio no existe
+    try:
+        with os.scandir(path) as entries:
+            names = [entry.name for entry in entries]
+    except (FileNotFoundError, NotADirectoryError) as e:
+        logger.warning("Directorio no encontrado, se omite el procesamiento para: %s (%s)", path, e)
+        return []
+
+    # Filtramos de una vez; los descartados solo se cuentan para el resumen
+    filenames = [name for name in names if name.endswith(WLS_SUFFIX)]
+    skipped = len(names) - len(filenames)
+
+    logger.info("Estación %s: %d ficheros .wls encontrados, %d ignorados", station, len(filenames), skipped)
+
+    # Todos los ficheros de la estación van en un único lote, con una sola conexión y un solo commit
+    if not filenames:
+        return []
+    return radarhf_waves.waves2db_batch(station, path, filenames)
+
+
+def delete_processed_files(station_paths, processed):
+    """
+    Borra los ficheros .wls que se procesaron con éxito, según el diccionario devuelto por waves2db.
+    Solo se borran esos ficheros: uno que llegue después no se borra sin haberse procesado.
+    """
+    logger.info("--- Limpiando ficheros procesados ---")
+
+    _run_per_station(_delete_station_files, station_paths, processed)
+
+
+def _delete_station_files(station, station_paths, processed):
+    path = station_paths[station]
+    filenames = processed.get(station, [])
+    if not filenames:
+        return
+
+    # Caso habitual: el directorio solo contiene los ficheros procesados y se vacía de una vez
+    if _discard_directory(path, filenames):
+        logger.info("Estación %s: %d de %d ficheros borrados", station, len(filenames), len(filenames))
+        return
+
+    # Abrimos el directorio una vez y borramos relativo a él, sin resolver la ruta completa en cada fichero.
+    # En sistemas sin dir_fd (Windows) se borra con la ruta completa.
+    if os.unlink not in os.supports_dir_fd:
+        deleted = sum(_delete_file(path, filename) for filename in filenames)
+    else:
+        try:
+            dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError as e:
+            logger.error("No se pudo abrir el directorio %s para limpiar: %s", path, e)
+            return
 
         try:
-            filenames_in_dir = os.listdir(path)
-        except FileNotFoundError:
-            print(f"Directorio no encontrado, se omite: {path}")
-            continue
+            deleted = sum(_delete_file(path, filename, dir_fd) for filename in filenames)
+        finally:
+            os.close(dir_fd)
 
-        for filename in filenames_in_dir:
-            if filename.endswith('.wls'):
-                radarhf_waves.wave2db(station, path, filename)
-            else:
-                print(f"Se ignora el fichero '{filename}' porque no es un .wls")
+    logger.info("Estación %s: %d de %d ficheros borrados", station, deleted, len(filenames))
 
 
-def delete_processed_files(data_folder):
+def _discard_directory(path, filenames) -> bool:
     """
-    Busca y borra todos los ficheros .wls que han sido procesados.
+    Si el directorio contiene exactamente los ficheros indicados, lo aparta con un rename, crea uno vacío
+    en su lugar y borra el apartado en segundo plano. Devuelve False si hay que borrar fichero a fichero.
     """
-    print("\n--- Limpiando ficheros procesados ---")
+    try:
+        with os.scandir(path) as entries:
+            names = {entry.name for entry in entries}
+    except OSError:
+        return False
+    if names != set(filenames):
+        return False
 
-    for station in STATIONS:
-        path = os.path.join(data_folder, 'radarhf_tmp', 'wls', station)
+    trash_path = f"{path}.trash.{os.getpid()}"
+    try:
+        os.rename(path, trash_path)
+    except OSError as e:
+        logger.debug("No se pudo apartar el directorio %s, se borra fichero a fichero: %s", path, e)
+        return False
+    try:
+        # El directorio nuevo conserva los permisos del original (mkdir aplica la umask)
+        mode = stat.S_IMODE(os.stat(trash_path).st_mode)
+        try:
+            os.mkdir(path, mode)
+        except FileExistsError:
+            pass
+        os.chmod(path, mode)
+    except OSError as e:
+        logger.warning("No se pudo recrear el directorio %s, se borra fichero a fichero: %s", path, e)
+        try:
+            os.rename(trash_path, path)
+        except OSError as e:
+            logger.error("No se pudo restaurar el directorio %s desde %s: %s", path, trash_path, e)
+        return False
 
-        if not os.path.isdir(path):
-            print(f"Directorio no encontrado para limpiar: {path}")
-            continue
+    # Un fichero llegado entre el scandir y el rename no se ha cargado: vuelve al directorio nuevo
+    if not _restore_late_files(trash_path, path, filenames):
+        logger.error("Se conserva %s para revisarlo: contiene ficheros sin cargar", trash_path)
+        return True
 
-        for filename in os.listdir(path):
-            if filename.endswith('.wls'):
-                file_to_delete = os.path.join(path, filename)
-                try:
-                    os.remove(file_to_delete)
-                    print(f"Fichero borrado: {file_to_delete}")
-                except OSError as e:
-                    print(f"Error al borrar el fichero {file_to_delete}: {e}")
+    # El borrado real no retrasa al resto del proceso; el intérprete espera a que acabe antes de salir
+    _get_cleanup_executor().submit(_remove_trash, trash_path)
+    return True
+
+
+def _restore_late_files(trash_path, path, filenames) -> bool:
+    keep = set(filenames)
+    try:
+        with os.scandir(trash_path) as entries:
+            late = [entry.name for entry in entries if entry.name not in keep]
+    except OSError as e:
+        logger.error("No se pudo revisar el directorio %s: %s", trash_path, e)
+        return False
+
+    restored = True
+    for name in late:
+        try:
+            os.rename(os.path.join(trash_path, name), os.path.join(path, name))
+        except OSError as e:
+            logger.error("No se pudo devolver el fichero %s a %s: %s", name, path, e)
+            restored = False
+        else:
+            logger.debug("Fichero llegado durante la limpieza, se conserva: %s", name)
+    return restored
+
+
+def _get_cleanup_executor() -> ThreadPoolExecutor:
+    global _cleanup_executor
+    with _cleanup_lock:
+        if _cleanup_executor is None:
+            _cleanup_executor = ThreadPoolExecutor(max_workers=1)
+        return _cleanup_executor
+
+
+def _remove_trash(trash_path):
+    def log_error(function, failed_path, error):
+        logger.error("No se pudo borrar %s (%s): %s", failed_path, function.__name__, error)
+
+    # onexc existe desde Python 3.12; en versiones anteriores se usa onerror, que recibe exc_info
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(trash_path, onexc=log_error)
+    else:
+        shutil.rmtree(trash_path, onerror=lambda function, failed_path, exc_info:
+                      log_error(function, failed_path, exc_info[1]))
+
+
+def _delete_file(path, filename, dir_fd=None) -> bool:
+    file_to_delete = os.path.join(path, filename)
+    try:
+        if dir_fd is None:
+            os.unlink(file_to_delete)
+        else:
+            os.unlink(filename, dir_fd=dir_fd)
+    except OSError as e:
+        logger.error("Error al borrar el fichero %s: %s", file_to_delete, e)
+        return False
+    logger.debug("Fichero borrado: %s", file_to_delete)
+    return True
+
+
+def run_pipeline(data_folder, number_of_last_files=3):
+    """
+    Descarga, procesa y limpia cada estación en cuanto su descarga termina, en lugar de esperar
+    a que acaben todas las descargas para empezar a procesar.
+    Devuelve un diccionario {estación: [ficheros procesados con éxito]}.
+    """
+    downloaded = queue.Queue(maxsize=len(STATIONS))
+    producer = threading.Thread(target=_download_stations,
+                                args=(data_folder, number_of_last_files, downloaded))
+    producer.start()
+
+    station_paths = get_station_paths(data_folder)
+    processed = {}
+    with ThreadPoolExecutor(max_workers=len(STATIONS)) as executor:
+        futures = {}
+        # None marca el final de las descargas
+        while (station := downloaded.get()) is not None:
+            futures[station] = executor.submit(_ingest_and_clean, station, station_paths)
+        for station, future in futures.items():
+            processed[station] = future.result()
+
+    producer.join()
+    return processed
+
+
+def _download_stations(data_folder, number_of_last_files, downloaded):
+    # getradarfiles descarga las estaciones en paralelo y avisa de cada una en cuanto termina;
+    # las que fallan ya las registra getradarfiles y no se encolan
+    try:
+        getradarfiles.get_waves_files(STATIONS, data_folder, number_of_last_files, on_station_done=downloaded.put)
+    except Exception as e:
+        # El detalle de cada estación ya se registró al fallar; aquí solo se deja constancia del final
+        logger.debug("La descarga de estaciones terminó con errores: %s", e)
+    finally:
+        downloaded.put(None)
+
+
+def _ingest_and_clean(station, station_paths):
+    processed = _process_station(station, station_paths)
+    _delete_station_files(station, station_paths, {station: processed})
+    return processed
+
+
+def stream_latest_files(number_of_last_files=1):
+    """
+    Carga los últimos ficheros .wls de cada estación leyéndolos directamente del servidor SFTP,
+    sin descargarlos a disco. Usa una única conexión SFTP y una única transacción.
+    """
+    connection = radarhf_waves.get_db_connection(radarhf_waves.DB_JSON_FILE)
+    if not connection:
+        logger.error("No se pudo obtener la conexión a la base de datos. No se procesa ningún fichero.")
+        return
+
+    try:
+        try:
+            sftp = getradarfiles.get_stfp(r'pass/combine.json')
+        except Exception as e:
+            logger.error("No se pudo abrir la conexión SFTP. No se procesa ningún fichero: %s", e)
+            return
+
+        try:
+            with connection:
+                id_sites = radarhf_waves.get_id_sites(connection)
+                for station in STATIONS:
+                    _stream_station(connection, id_sites, sftp, station, number_of_last_files)
+        finally:
+            sftp.close()
+    finally:
+        connection.close()
+
+
+def _stream_station(connection, id_sites, sftp, station, number_of_last_files):
+    remote_path = getradarfiles.WAVES_REMOTE_ROOT_PATH + station
+    remote_files = []
+    try:
+        for path, files in getradarfiles.sftp_get_filenames_by_extension(sftp, remote_path,
+                                                                         getradarfiles.WAVES_SIGNATURE):
+            remote_files.extend(path + "/" + filename for filename, _ in files[-number_of_last_files:])
+    except OSError as e:
+        logger.error("No se pudo listar el directorio remoto %s: %s", remote_path, e)
+        return
+
+    loaded = sum(radarhf_waves.stream2db(connection, id_sites, sftp, station, remote_file)
+                 for remote_file in remote_files)
+    logger.info("Estación %s: %d de %d ficheros remotos cargados", station, loaded, len(remote_files))
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # Con --stream solo se cargan los últimos ficheros directamente desde el servidor, sin pasar por disco
+    if '--stream' in sys.argv[1:]:
+        stream_latest_files()
+        logger.info("Proceso completado.")
+        sys.exit()
+
     root = r'../datos/'
 
     # 1. Asegurar que los directorios locales existen (NUEVO PASO)
     create_station_directories(root)
 
-    # 2. Descargar los ficheros (ahora no fallará por falta de directorios)
-    getradarfiles.get_waves_files(STATIONS, root, number_of_last_files=3)
-
-    # 3. Procesar TODOS los ficheros descargados
-    waves2db(root)
-
-    # 4. Borrar los ficheros procesados
-    delete_processed_files(root)
+    # 2. Descargar, procesar y borrar los ficheros procesados con éxito, estación a estación:
+    #    cada estación se procesa en cuanto termina su descarga, mientras siguen las demás
+    run_pipeline(root, number_of_last_files=3)
 
-    print("\nProceso completado.")
\ No newline at end of file
+    logger.info("Proceso completado.")